@@ -8,6 +8,7 @@
 '''The nrsearchrank algorithm is provided in this module.'''
 
 
+from heapq import nlargest
 from hpyhex.hex import HexEngine, Piece, Hex
 from hpyhex.game_env import Game
 
@@ -15,24 +16,153 @@ from hpyhex.game_env import Game
 __all__ = ["nrsearchrank"]
 
 
+# Scored placements keyed by (radius, board, piece byte), evicted oldest first once full
+_CACHE_SIZE = 1 << 12
+_score_cache = {}
+# Bitboard tables keyed by radius, and placement tables keyed by (radius, piece byte)
+_layouts = {}
+_placements = {}
+# Population count of an int, int.bit_count is only available from Python 3.10
+_bit_count = getattr(int, 'bit_count', None) or (lambda value: bin(value).count('1'))
+# Translation of engine states, as bytes, into '0' and '1' characters
+_BLOCK_CHARS = bytes.maketrans(b'\x00\x01', b'01')
+
+
+def _board(engine: HexEngine) -> int:
+    """
+    Pack the engine into a bitboard, where bit n is the occupancy state of block n.
+    :param engine: The game engine
+    :return: The bitboard as an integer
+    """
+    return int(bytes(engine.states)[::-1].translate(_BLOCK_CHARS), 2)
+
+
+def _layout(radius: int) -> tuple[HexEngine, tuple[int, ...], tuple[int, ...], tuple[tuple[int, int], ...]]:
+    """
+    Get the bitboard tables of an engine radius, building them on first use.
+    :param radius: The radius of the engine
+    :return: An empty engine, the neighbor mask and padding count of every block, and every line as (mask, length)
+    """
+    layout = _layouts.get(radius)
+    if layout is None:
+        grid = HexEngine(radius)
+        coords = [grid.coordinate_block(index) for index in range(len(grid))]
+        neighbor_masks = []
+        paddings = []
+        for coord in coords:
+            mask = 0
+            padding = 0
+            for pos in Piece.positions:
+                index = grid.index_block(pos + coord)
+                if index == -1:
+                    padding += 1 # Padding counts as a neighbor
+                else:
+                    mask |= 1 << index
+            neighbor_masks.append(mask)
+            paddings.append(padding)
+        lines = {}
+        for index, coord in enumerate(coords):
+            for axis_key in (('i', coord.i), ('j', coord.j), ('k', coord.k)):
+                lines[axis_key] = lines.get(axis_key, 0) | 1 << index
+        layout = (grid, tuple(neighbor_masks), tuple(paddings), tuple((mask, _bit_count(mask)) for mask in lines.values()))
+        _layouts[radius] = layout
+    return layout
+
+
+def _placement_table(radius: int, piece_byte: int) -> tuple[int, tuple[tuple[Hex, int, tuple[int, ...], int, int, tuple[tuple[int, int], ...]], ...]]:
+    """
+    Get the length of a piece and every in-range placement of it on an empty engine, building the table on first use.
+    :param radius: The radius of the engine
+    :param piece_byte: The byte representation of the piece to place
+    :return: The length of the piece, and a tuple of (position, piece mask, neighbor masks, padding, total possible, touched lines),
+        in the order given by engine.check_positions
+    """
+    key = (radius, piece_byte)
+    table = _placements.get(key)
+    if table is None:
+        piece = Piece(piece_byte)
+        grid, neighbor_masks, paddings, lines = _layout(radius)
+        table = []
+        for a in range(radius * 2):
+            for b in range(radius * 2):
+                coord = Hex(a, b)
+                blocks = [pos + coord for pos, state in zip(Piece.positions, piece.states) if state]
+                indices = [grid.index_block(block) for block in blocks]
+                if -1 in indices:
+                    continue
+                mask = 0
+                for index in indices:
+                    mask |= 1 << index
+                total_possible = sum(6 - piece.count_neighbors(block) for block in blocks)
+                table.append((coord, mask, tuple(neighbor_masks[index] for index in indices),
+                              sum(paddings[index] for index in indices), total_possible,
+                              tuple(line for line in lines if line[0] & mask)))
+        table = (len(piece), tuple(table))
+        _placements[key] = table
+    return table
+
+
+def _score_positions(radius: int, board: int, base_eliminated: int, piece_byte: int) -> tuple[tuple[Hex, float], ...]:
+    """
+    Score every valid position of a piece on a bitboard, reusing a previous result for the same board and piece.
+    The dense index and eliminations are computed with bitwise operations.
+    :param radius: The radius of the engine
+    :param board: The bitboard of the engine
+    :param base_eliminated: The number of blocks in lines of the board that are already full
+    :param piece_byte: The byte representation of the piece to place
+    :return: A tuple of (position, score) pairs in the order given by engine.check_positions
+    """
+    key = (radius, board, piece_byte)
+    scored = _score_cache.get(key)
+    if scored is None:
+        length, table = _placement_table(radius, piece_byte)
+        scored = []
+        # Kernel over plain ints only; explicit loops beat map/builtin chains here on CPython 3.11+
+        for coord, mask, neighbors, padding, total_possible, lines in table:
+            if board & mask:
+                continue
+            if total_possible > 0:
+                total_populated = padding
+                for neighbor_mask in neighbors:
+                    total_populated += _bit_count(board & neighbor_mask)
+                score = total_populated / total_possible + length
+            else:
+                score = 0.0 + length
+            filled = board | mask
+            eliminated = base_eliminated
+            for line, count in lines:
+                if filled & line == line:
+                    eliminated += count
+            score += eliminated / radius
+            scored.append((coord, score))
+        scored = tuple(scored)
+        if len(_score_cache) >= _CACHE_SIZE:
+            del _score_cache[next(iter(_score_cache))]
+        _score_cache[key] = scored
+    return scored
+
+
 def nrsearchrank(engine: HexEngine, queue: list[Piece], significant_choices: int = 9) -> list[tuple[int, Hex]]:
     """
     A heuristic algorithm that selects the best pieces and positions based on the dense index, and score gain of the game state.
+    The engine is only read, never copied or modified, so a live game engine can be passed without a snapshot.
     :param engine: The game engine
     :param queue: The queue of pieces available for placement
     :return: A list of tuples containing the index of the best pieces and the best positions to place it
     """
-    options = []
+    # The board is packed once and shared by every piece in the queue
+    radius = engine.radius
+    board = _board(engine)
+    # Lines that are already full are eliminated regardless of the placement
+    base_eliminated = sum(count for line, count in _layout(radius)[3] if board & line == line)
     seen_pieces = {}
     for piece_index, piece in enumerate(queue):
         key = int(piece)
-        if key in seen_pieces: continue
-        seen_pieces[key] = piece_index
-        for coord in engine.check_positions(piece):
-            score = engine.compute_dense_index(coord, piece) + len(piece)
-            copy_engine = engine.__copy__()
-            copy_engine.add_piece(coord, piece)
-            score += len(copy_engine.eliminate()) / engine.radius
-            options.append((piece_index, coord, score))
-    sorted_options = sorted(options, key=lambda item: item[2], reverse=True)
-    return [(item[0], item[1]) for item in sorted_options[:significant_choices]]
+        if key not in seen_pieces:
+            seen_pieces[key] = piece_index
+    # Options are produced lazily and consumed once by the selection below
+    options = ((piece_index, coord, score) for key, piece_index in seen_pieces.items()
+               for coord, score in _score_positions(radius, board, base_eliminated, key))
+    # Same result as a full descending sort truncated to significant_choices, ties kept in queue order
+    best_options = nlargest(significant_choices, options, key=lambda item: item[2])
+    return [(item[0], item[1]) for item in best_options]
@@ -5,13 +5,21 @@
 A simple helper for saving, loading, and generating machine learning data for the HappyHex Autoplay feature.
 Contains the following functions:
 
-- save_training_dataset: save training data to a text file
-- load_training_data: load training data from a text file
+- save_training_dataset: save training data to a text or binary file
+- load_training_data: load training data from a text or binary file
 - generate_training_data: generate training data based on a certain algorithm,
   which will be provided in its sample directory as a function, and optionally store or return that data.
+
+Binary files start with a magic header, followed by one record per sample:
+the block count of the engine (uint16), the engine states packed one bit per block,
+the queue length and piece bytes, then the option count and (index, line, pos) bytes of each option.
+Engines are limited to 65535 blocks, and queue lengths, option counts, indices, lines and positions
+to the range 0 to 255; saving data outside these limits in binary raises ValueError.
 '''
 
-from random import random
+import struct
+from multiprocessing import Pool
+from random import random, seed, getrandbits
 from hpyhex.hex import HexEngine, Piece, Hex
 from hpyhex.game import Game
 
@@ -19,7 +27,119 @@ from hpyhex.game import Game
 __all__ = ["save_training_dataset", "load_training_data", "generate_training_data"]
 
 
-def save_training_dataset(data: list[tuple[HexEngine, list[Piece], list[tuple[int, Hex]]]], filename: str, print_err: bool = False) -> None:
+# Number of lines buffered before each write when saving
+_WRITE_CHUNK = 4096
+# Header identifying the binary format
+_BINARY_MAGIC = b'HHLM\x01'
+# Translation of engine states, as bytes, into '0' and '1' characters
+_BLOCK_CHARS = bytes.maketrans(b'\x00\x01', b'01')
+
+
+def _engine_string(engine: HexEngine) -> str:
+    '''
+    Convert the engine to its string of 0s and 1s, the same as repr(engine), in a single translation of its states.
+
+    Parameters:
+        engine (HexEngine): The engine to convert.
+    Returns:
+        engine_data (str): The occupancy state of each block as '0' or '1'.
+    '''
+    return bytes(engine.states).translate(_BLOCK_CHARS).decode('ascii')
+
+
+def _write_text(f, data: list[tuple[HexEngine, list[Piece], list[tuple[int, Hex]]]], print_err: bool) -> None:
+    '''
+    Write training data to an open text file, one line per sample.
+
+    Parameters:
+        f (file): The text file to write to.
+        data (list): A list of tuples containing the engine, queue, and best options.
+        print_err (bool): Whether to print errors if they occur during saving.
+    Returns:
+        None
+    '''
+    lines = []
+    for engine, queue, best_options in data:
+        try:
+            # Engine booleans as string of 0s and 1s
+            engine_data = _engine_string(engine)
+            # Queue as comma-separated bytes
+            queue_data = ','.join(map(repr, queue))
+            # Best options as index:line:pos
+            result_data = ','.join(['%d:%d:%d' % (idx, coord.i, coord.k) for idx, coord in best_options])
+            # Buffer line
+            lines.append(f"{engine_data} | {queue_data} | {result_data}\n")
+        except Exception as e:
+            if print_err:
+                print(f"Error saving data for engine {engine}: {e}")
+        # Write buffered lines in chunks to bound memory
+        if len(lines) >= _WRITE_CHUNK:
+            f.write(''.join(lines))
+            lines.clear()
+    f.write(''.join(lines))
+
+
+def _check_binary_limits(data: list[tuple[HexEngine, list[Piece], list[tuple[int, Hex]]]]) -> None:
+    '''
+    Check that every sample fits the binary format, before any of them is written.
+    Malformed samples are left to the writer, which reports and skips them like the text writer does.
+
+    Parameters:
+        data (list): A list of tuples containing the engine, queue, and best options.
+    Returns:
+        None
+    Raises:
+        ValueError: If a sample exceeds the limits of the binary format.
+    '''
+    for engine, queue, best_options in data:
+        try:
+            if len(engine) > 0xFFFF:
+                raise ValueError(f"Engine with {len(engine)} blocks exceeds the binary format limit of 65535")
+            if len(queue) > 0xFF or len(best_options) > 0xFF:
+                raise ValueError(f"Queue of {len(queue)} pieces or {len(best_options)} options exceeds the binary format limit of 255")
+            for idx, coord in best_options:
+                if not (0 <= idx <= 0xFF and 0 <= coord.i <= 0xFF and 0 <= coord.k <= 0xFF):
+                    raise ValueError(f"Option {idx}:{coord.i}:{coord.k} is outside the binary format range of 0 to 255")
+        except (TypeError, AttributeError):
+            continue
+
+
+def _write_binary(f, data: list[tuple[HexEngine, list[Piece], list[tuple[int, Hex]]]], print_err: bool) -> None:
+    '''
+    Write training data to an open binary file, one record per sample.
+    The data must have passed _check_binary_limits.
+
+    Parameters:
+        f (file): The binary file to write to, positioned after the magic header.
+        data (list): A list of tuples containing the engine, queue, and best options.
+        print_err (bool): Whether to print errors if they occur during saving.
+    Returns:
+        None
+    '''
+    records = []
+    for engine, queue, best_options in data:
+        try:
+            # Engine states as bits, block n in bit n
+            length = len(engine)
+            engine_data = struct.pack('<H', length) + int(bytes(engine.states)[::-1].translate(_BLOCK_CHARS), 2).to_bytes((length + 7) // 8, 'little')
+            # Queue as bytes
+            queue_data = bytes([len(queue)]) + bytes(map(int, queue))
+            # Best options as index, line, pos bytes
+            result_data = bytes([len(best_options)]) + b''.join(struct.pack('BBB', idx, coord.i, coord.k) for idx, coord in best_options)
+            # Buffer record
+            records.append(engine_data + queue_data + result_data)
+        except Exception as e:
+            if print_err:
+                print(f"Error saving data for engine {engine}: {e}")
+        # Write buffered records in chunks to bound memory
+        if len(records) >= _WRITE_CHUNK:
+            f.write(b''.join(records))
+            records.clear()
+    f.write(b''.join(records))
+
+
+def save_training_dataset(data: list[tuple[HexEngine, list[Piece], list[tuple[int, Hex]]]], filename: str, print_err: bool = False,
+                          binary: bool = False) -> None:
     '''
     Save training data to a file.
     
@@ -27,32 +147,63 @@ def save_training_dataset(data: list[tuple[HexEngine, list[Piece], list[tuple[in
         data (list): A list of tuples containing the engine, queue, and best options.
         filename (str): The file to save the training data to.
         print_err (bool): Whether to print errors if they occur during saving.
+        binary (bool): Whether to save in the compact binary format instead of text.
     Returns:
         None
+    Raises:
+        ValueError: If binary is True and a sample exceeds the limits of the binary format.
     '''
+    if binary:
+        # Checked before opening, so a rejected dataset never leaves a loadable partial file
+        _check_binary_limits(data)
     try:
-        with open(filename, 'w') as f:
-            for engine, queue, best_options in data:
-                try:
-                    # Engine booleans as string of 0s and 1s
-                    engine_data = repr(engine)
-                    # Queue as comma-separated bytes
-                    queue_data = ','.join(repr(piece) for piece in queue)
-                    # Best options as index:line:pos
-                    result_data = ','.join(f"{idx}:{coord.i}:{coord.k}" for idx, coord in best_options)
-                    # Write line
-                    f.write(f"{engine_data} | {queue_data} | {result_data}\n")
-                except Exception as e:
-                    if print_err:
-                        print(f"Error saving data for engine {engine}: {e}")
+        if binary:
+            with open(filename, 'wb') as f:
+                f.write(_BINARY_MAGIC)
+                _write_binary(f, data, print_err)
+        else:
+            with open(filename, 'w') as f:
+                _write_text(f, data, print_err)
     except IOError as e:
         if print_err:
             print(f"Error writing to file {filename}: {e}")
 
 
+def _read_binary(buffer: bytes) -> list[tuple[HexEngine, list[Piece], list[tuple[int, Hex]]]]:
+    '''
+    Read training data records from the contents of a binary file.
+
+    Parameters:
+        buffer (bytes): The contents of the file after the magic header.
+    Returns:
+        data (list[tuple]): A list of tuples containing the engine, queue, and best options.
+    '''
+    dataset = []
+    view = memoryview(buffer)
+    pos = 0
+    while pos < len(view):
+        # Reconstruct engine
+        length, = struct.unpack_from('<H', view, pos)
+        pos += 2
+        size = (length + 7) // 8
+        bits = int.from_bytes(view[pos:pos + size], 'little')
+        pos += size
+        engine = HexEngine(format(bits, f'0{length}b')[::-1])
+        # Reconstruct queue
+        size = view[pos]
+        queue = [Piece(b) for b in view[pos + 1:pos + 1 + size]]
+        pos += 1 + size
+        # Reconstruct results
+        size = view[pos] * 3
+        results = [(idx, Hex(line_no, pos_no)) for idx, line_no, pos_no in struct.iter_unpack('BBB', view[pos + 1:pos + 1 + size])]
+        pos += 1 + size
+        dataset.append((engine, queue, results))
+    return dataset
+
+
 def load_training_data(filename: str, print_err: bool = False) -> list[tuple[HexEngine, list[Piece], list[tuple[int, Hex]]]]:
     """
-    Load training data from a file.
+    Load training data from a file, detecting the binary format by its magic header.
 
     Parameters:
         filename (str): The file to load the training data from.
@@ -62,9 +213,14 @@ def load_training_data(filename: str, print_err: bool = False) -> list[tuple[Hex
     """
     dataset = []
     try:
+        with open(filename, 'rb') as f:
+            if f.read(len(_BINARY_MAGIC)) == _BINARY_MAGIC:
+                return _read_binary(f.read())
         with open(filename, 'r') as f:
             for line in f:
-                engine_str, queue_str, result_str = [part.strip() for part in line.strip().split('|')]
+                # Surrounding whitespace is ignored by HexEngine and int
+                engine_str, _, rest = line.partition('|')
+                queue_str, _, result_str = rest.partition('|')
                 # Reconstruct engine
                 engine = HexEngine(engine_str)
                 # Reconstruct queue
@@ -72,8 +228,9 @@ def load_training_data(filename: str, print_err: bool = False) -> list[tuple[Hex
                 # Reconstruct results
                 results = []
                 for res in result_str.split(','):
-                    idx, line_no, pos_no = map(int, res.split(':'))
-                    results.append((idx, Hex(int(line_no), int(pos_no))))
+                    idx, _, coord_str = res.partition(':')
+                    line_no, _, pos_no = coord_str.partition(':')
+                    results.append((int(idx), Hex(int(line_no), int(pos_no))))
                 dataset.append((engine, queue, results))
     except IOError as e:
         if print_err:
@@ -81,57 +238,163 @@ def load_training_data(filename: str, print_err: bool = False) -> list[tuple[Hex
     return dataset
 
 
+def _simulate_game(args: tuple) -> tuple[list[tuple[HexEngine, list[Piece], list[tuple[int, Hex]]]], int, int]:
+    '''
+    Play one game with an algorithm and collect its training data.
+
+    Parameters:
+        args (tuple): The algorithm, engine radius, queue size, significant choices, remove head, remove tail, move dropout,
+            and the random seed of the game, or None to continue from the current random state.
+    Returns:
+        result (tuple): The kept game data, the final turn, and the final score of the game.
+    '''
+    algorithm, engine_radius, queue_size, significant_choices, remove_head, remove_tail, move_dropout, game_seed = args
+    if game_seed is not None:
+        seed(game_seed)
+    inner_data = []
+    game = Game(engine_radius, queue_size)
+    while not game.end:
+        # Run the algorithm to get the best moves
+        best_moves = algorithm(game.engine, game.queue, significant_choices)
+        if not best_moves:
+            break
+        # Make the first best move
+        piece_index, coord = best_moves[0]
+        # Roll the dropout first, so dropped moves are never copied
+        keep = random() > move_dropout
+        if keep:
+            copy_engine = game.engine.__copy__()
+            copy_queue = game.queue.copy()
+        if not game.add_piece(piece_index, coord):
+            break
+        # Collect the engine, queue, and best options
+        if keep:
+            # Only add the data if the move is not dropped
+            inner_data.append((copy_engine, copy_queue, best_moves))
+    # Strip the last 5% of the game data as it is not meaningful, keeping the other 95%
+    data_len = len(inner_data)
+    turn, score = game.result
+    return inner_data[int(data_len * remove_head):int(data_len * (1 - remove_tail))], turn, score
+
+
+def _simulate_game_portable(args: tuple) -> tuple[list[tuple[str, list[int], list[tuple[int, int, int]]]], int, int]:
+    '''
+    Play one game in a worker process and return its training data as plain values.
+    Piece and Hex instances are cached singletons, and unpickling them overwrites the cached instances,
+    so they must not be sent between processes.
+
+    Parameters:
+        args (tuple): The arguments of _simulate_game.
+    Returns:
+        result (tuple): The kept game data as (engine string, piece bytes, (index, line, pos) options),
+            the final turn, and the final score of the game.
+    '''
+    game_data, turn, score = _simulate_game(args)
+    return [(_engine_string(engine), [int(piece) for piece in queue], [(idx, coord.i, coord.k) for idx, coord in best_options])
+            for engine, queue, best_options in game_data], turn, score
+
+
+def _play_games(game_args: tuple, processes: int):
+    '''
+    Play games indefinitely, in worker processes if more than one process is requested.
+    Closing the generator terminates the worker processes.
+
+    Parameters:
+        game_args (tuple): The arguments of _simulate_game, without the random seed.
+        processes (int): The number of worker processes to use.
+    Yields:
+        result (tuple): The result of _simulate_game for each game, in the order the games were started.
+    '''
+    if processes <= 1:
+        while True:
+            yield _simulate_game(game_args + (None,))
+    with Pool(processes) as pool:
+        # Seeds are drawn from the main random state, so seeding it makes the run reproducible
+        results = pool.imap(_simulate_game_portable, [game_args + (getrandbits(32),) for _ in range(processes * 4)])
+        while True:
+            # Queue the next round before draining this one, so workers that finish early never wait for the slowest game
+            next_results = pool.imap(_simulate_game_portable, [game_args + (getrandbits(32),) for _ in range(processes * 4)])
+            for game_data, turn, score in results:
+                yield [(HexEngine(engine), [Piece(b) for b in queue], [(idx, Hex(line_no, pos_no)) for idx, line_no, pos_no in best_options])
+                       for engine, queue, best_options in game_data], turn, score
+            results = next_results
+
+
 def generate_training_data(num_samples: int, algorithm,
                            engine_radius: int = 5, queue_size: int = 3, significant_choices: int = 7,
                            remove_head: float = 0.0, remove_tail: float = 0.05, move_dropout: float = 0.05,
-                           verbose: bool = True) -> list[tuple[HexEngine, list[Piece], list[tuple[int, Hex]]]]:
+                           verbose: bool = True, processes: int = 1,
+                           filename: str = None, return_data: bool = True, binary: bool = False,
+                           progress_interval: int = 1, print_err: bool = False) -> list[tuple[HexEngine, list[Piece], list[tuple[int, Hex]]]]:
     '''
     Generate a training dataset with random game states and save it to a file if filename is given.
+    The data of each game is written to the file as soon as the game ends, so memory stays bounded
+    when the data is not returned, and finished games are kept if generation is interrupted.
     
     Parameters:
         num_samples (int): The number of samples to generate.
         algorithm (callable): The algorithm to use for generating the game states.
+            It must be importable by name (defined at module level) if processes is greater than one.
         engine_radius (int): The radius of the HexEngine.
         queue_size (int): The size of the queue of pieces.
         significant_choices (int): The number of significant choices to consider.
         remove_head (float): The fraction of the first part of the game data to remove.
         remove_tail (float): The fraction of the last part of the game data to remove.
         move_dropout (float): The probability of dropping a move.
-        return_data (bool): Whether to return the generated data instead of saving it.
         verbose (bool): Whether to print progress messages.
+        processes (int): The number of worker processes that play games in parallel.
+        filename (str): The file to save the training data to, or None to not save it.
+        return_data (bool): Whether to keep and return the generated data, in addition to saving it.
+        binary (bool): Whether to save in the compact binary format instead of text.
+        progress_interval (int): The number of games between progress messages when verbose.
+        print_err (bool): Whether to print errors if they occur during saving.
     Returns:
-        data (list[tuple]): A list of tuples containing the engine, queue, and best options.
+        data (list[tuple]): A list of tuples containing the engine, queue, and best options,
+            or an empty list if return_data is False.
+    Raises:
+        ValueError: If progress_interval is less than one,
+            or binary is True and the arguments or a sample exceed the limits of the binary format.
     '''
+    if progress_interval < 1:
+        raise ValueError("Progress interval must be greater than or equals one")
+    if filename is not None and binary:
+        # Rejected before any game is played or the file is opened
+        if queue_size > 0xFF or significant_choices > 0xFF:
+            raise ValueError(f"Queue size {queue_size} or significant choices {significant_choices} exceeds the binary format limit of 255")
+        if 1 + 3 * engine_radius * (engine_radius - 1) > 0xFFFF or engine_radius * 2 - 2 > 0xFF:
+            raise ValueError(f"Engine radius {engine_radius} exceeds the binary format limits of 65535 blocks and coordinates up to 255")
     data = []
+    count = 0
     sample = 0
-    while len(data) < num_samples:
-        inner_data = []
-        game = Game(engine_radius, queue_size)
-        while not game.end:
-            # Run the algorithm to get the best moves
-            best_moves = algorithm(game.engine, game.queue, significant_choices)
-            if not best_moves:
-                break
-            # Make the first best move
-            piece_index, coord = best_moves[0]
-            copy_engine = game.engine.__copy__()
-            copy_queue = game.queue.copy()
-            if not game.add_piece(piece_index, coord):
-                break
-            # Collect the engine, queue, and best options
-            if random() > move_dropout:
-                # Only add the data if the move is not dropped
-                inner_data.append((copy_engine, copy_queue, best_moves))
-        # Strip the last 5% of the game data as it is not meaningful, saving the other 95% to data
-        data_len = len(inner_data)
-        if data_len > 0:
-            data.extend(inner_data[int(data_len * remove_head):int(data_len * (1 - remove_tail))])
-        turn, score = game.result
-        sample += 1
-        if verbose:
-            print(f"Game {sample} ends with {turn}, {score}, {100*len(data)/num_samples:.2f}% complete.")
-    # Strip the extra data to the specified number of samples
-    data = data[:num_samples]
+    f = None
+    if filename is not None:
+        f = open(filename, 'wb' if binary else 'w')
+        if binary:
+            f.write(_BINARY_MAGIC)
+    write = _write_binary if binary else _write_text
+    games = _play_games((algorithm, engine_radius, queue_size, significant_choices, remove_head, remove_tail, move_dropout), processes)
+    try:
+        # Check before each game, so no game is played and no worker process is started once enough samples exist
+        while count < num_samples:
+            game_data, turn, score = next(games)
+            # Strip the extra data to the specified number of samples
+            game_data = game_data[:num_samples - count]
+            count += len(game_data)
+            if f is not None:
+                if binary:
+                    _check_binary_limits(game_data)
+                write(f, game_data, print_err)
+                f.flush()
+            if return_data:
+                data.extend(game_data)
+            sample += 1
+            # Progress is only reported from the main process, every progress_interval games and for the last game
+            if verbose and (sample % progress_interval == 0 or count >= num_samples):
+                print(f"Game {sample} ends with {turn}, {score}, {100*count/num_samples:.2f}% complete.")
+    finally:
+        games.close()
+        if f is not None:
+            f.close()
     if verbose:
-        print(f"Generated {len(data)} samples.")
-    return data
\ No newline at end of file
+        print(f"Generated {count} samples.")
+    return data